@@ -1,19 +1,25 @@
 #!/usr/bin/env python3
 """
 命令審計日誌查看工具
-用於分析命令執行模式和使用統計
+用於分析命令執行模式和使用統計，並支援日誌壓縮歸檔與保留策略
 """
 
 import sys
+import gzip
 import json
 import argparse
 from datetime import datetime, timedelta
 from collections import defaultdict, Counter
 import os
 
+ARCHIVE_INDEX = "index.json"
+HOUR_KEY_FORMAT = "%Y-%m-%dT%H"
+
 class CommandAuditViewer:
-    def __init__(self, log_file=".command_audit.log"):
+    def __init__(self, log_file=".command_audit.log", archive_dir=None):
         self.log_file = log_file
+        self.archive_dir = archive_dir or os.path.join(
+            os.path.dirname(log_file) or '.', '.command_audit_archive')
         self.entries = []
         
     def load_logs(self):
@@ -71,12 +77,214 @@ class CommandAuditViewer:
         else:
             return 'other'
     
+    def load_archive_index(self, strict=False):
+        """載入歸檔索引（僅包含各分段摘要，不讀取原始日誌）
+
+        strict 為 True 時索引損壞會拋出異常，避免壓縮時以空索引覆寫歷史摘要
+        """
+        index_file = os.path.join(self.archive_dir, ARCHIVE_INDEX)
+        if not os.path.exists(index_file):
+            return {'segments': {}}
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            if strict:
+                raise ValueError(f"歸檔索引無法讀取，為避免覆寫已停止: {index_file} ({e})")
+            print(f"⚠️  讀取歸檔索引失敗: {e}")
+            return {'segments': {}}
+
+    def _save_archive_index(self, index):
+        """原子寫入歸檔索引"""
+        index_file = os.path.join(self.archive_dir, ARCHIVE_INDEX)
+        tmp_file = index_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_file, index_file)
+
+    def _archived_counts(self, since=None):
+        """從歸檔摘要彙總命令類型與小時分布
+
+        since 為 None 時彙總全部歸檔；否則只計入該時間所在小時及之後的桶
+        """
+        segments = self.load_archive_index()['segments']
+        since_key = since.strftime(HOUR_KEY_FORMAT) if since else None
+        command_types = Counter()
+        hourly = Counter()
+        first = last = None
+        for summary in segments.values():
+            if since_key and summary['last'][:13] < since_key:
+                continue
+            for hour_key, counts in summary['hourly'].items():
+                if since_key and hour_key < since_key:
+                    continue
+                command_types.update(counts)
+                hourly[hour_key] += sum(counts.values())
+            seg_first = datetime.fromisoformat(summary['first'])
+            seg_last = datetime.fromisoformat(summary['last'])
+            first = seg_first if first is None else min(first, seg_first)
+            last = seg_last if last is None else max(last, seg_last)
+        return command_types, hourly, first, last
+
+    def _log_is_due(self, max_size_mb=None, max_age_hours=None):
+        """判斷是否達到壓縮門檻（未指定門檻時一律壓縮）
+
+        壓縮寫回的保留記錄可能排在壓縮期間新寫入的記錄之後，
+        因此逐行掃描，遇到第一條超齡記錄即返回
+        """
+        if max_size_mb is None and max_age_hours is None:
+            return True
+        if max_size_mb is not None and \
+                os.path.getsize(self.log_file) >= max_size_mb * 1024 * 1024:
+            return True
+        if max_age_hours is not None:
+            cutoff_time = datetime.now() - timedelta(hours=max_age_hours)
+            with open(self.log_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    entry = self.parse_entry(line)
+                    if entry and entry['timestamp'] < cutoff_time:
+                        return True
+        return False
+
+    def _write_segment(self, archive_name, lines):
+        """原子寫入單個壓縮分段（重複執行結果相同）"""
+        archive_path = os.path.join(self.archive_dir, archive_name)
+        tmp_file = archive_path + '.tmp'
+        with gzip.open(tmp_file, 'wt', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line + '\n')
+        os.replace(tmp_file, archive_path)
+
+    def compact(self, keep_hours=24, max_size_mb=None, max_age_hours=None,
+                retention_days=None):
+        """將舊日誌按日期壓縮歸檔，並套用保留策略
+
+        - 日誌先改名為 .compacting，鉤子的新記錄寫入新文件，不會遺失
+        - 早於 keep_hours 的條目寫入 command_audit-YYYY-MM-DD-<run>.log.gz
+        - 每日摘要（類型/小時計數、首末時間）保存在 index.json
+        - 超過 retention_days 的壓縮檔會被刪除，但摘要保留
+        - 最近記錄與無法解析的行追加回日誌，刪除 .compacting 即完成本次壓縮；
+          中斷後再次執行會沿用同一 run 的切分時間與進度續做，不會遺失或重複計數
+        """
+        compacting_file = self.log_file + '.compacting'
+        os.makedirs(self.archive_dir, exist_ok=True)
+        index = self.load_archive_index(strict=True)
+
+        if os.path.exists(compacting_file) and index.get('pending'):
+            pending = index['pending']
+            print(f"ℹ️  續做未完成的壓縮: {pending['run']}")
+        elif os.path.exists(compacting_file):
+            raise ValueError(f"發現無記錄的壓縮中文件，請手動檢查: {compacting_file}")
+        else:
+            if not os.path.exists(self.log_file):
+                print(f"❌ 審計日誌文件不存在: {self.log_file}")
+                return False
+            if not self._log_is_due(max_size_mb, max_age_hours):
+                print("ℹ️  未達壓縮門檻，跳過壓縮")
+                return True
+            now = datetime.now()
+            pending = index['pending'] = {
+                'run': now.strftime('%Y%m%dT%H%M%S%f'),
+                'keep_hours': keep_hours,
+                'cutoff': (now - timedelta(hours=keep_hours)).isoformat(),
+                'kept_written': False,
+            }
+            self._save_archive_index(index)
+            os.rename(self.log_file, compacting_file)
+
+        # 續做時沿用首次執行的切分時間，保證同一批記錄的歸屬不變
+        run_id = pending['run']
+        cutoff_time = datetime.fromisoformat(pending['cutoff'])
+        segments = defaultdict(list)
+        kept_lines = []
+
+        with open(compacting_file, 'r', encoding='utf-8') as f:
+            for raw_line in f:
+                line = raw_line.rstrip('\n')
+                entry = None
+                if line.strip() and not line.startswith('#'):
+                    entry = self.parse_entry(line.strip())
+                if entry and entry['timestamp'] < cutoff_time:
+                    segments[entry['timestamp'].strftime('%Y-%m-%d')].append(
+                        (line, entry))
+                elif line:
+                    kept_lines.append(line)
+
+        archived = 0
+        archived_segments = 0
+        for day in sorted(segments):
+            entries = segments[day]
+            archive_name = f"command_audit-{day}-{run_id}.log.gz"
+            summary = index['segments'].setdefault(day, {
+                'archives': [],
+                'runs': [],
+                'total': 0,
+                'counts': {},
+                'hourly': {},
+                'first': None,
+                'last': None,
+            })
+            if run_id in summary['runs']:
+                # 本次 run 已提交到索引（中斷後續做）
+                continue
+
+            self._write_segment(archive_name, [line for line, _ in entries])
+
+            counts = Counter(summary['counts'])
+            for _, entry in entries:
+                counts[entry['type']] += 1
+                hour_counts = summary['hourly'].setdefault(
+                    entry['timestamp'].strftime(HOUR_KEY_FORMAT), {})
+                hour_counts[entry['type']] = hour_counts.get(entry['type'], 0) + 1
+            timestamps = [entry['timestamp'].isoformat() for _, entry in entries]
+            if summary['first']:
+                timestamps.append(summary['first'])
+                timestamps.append(summary['last'])
+            summary['counts'] = dict(counts)
+            summary['total'] += len(entries)
+            summary['first'] = min(timestamps)
+            summary['last'] = max(timestamps)
+            summary['archives'].append(archive_name)
+            summary['runs'].append(run_id)
+            archived += len(entries)
+            archived_segments += 1
+
+        purged = 0
+        if retention_days is not None:
+            retention_cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+            for summary in index['segments'].values():
+                if summary['archives'] and summary['last'] < retention_cutoff:
+                    for archive_name in summary['archives']:
+                        archive_path = os.path.join(self.archive_dir, archive_name)
+                        if os.path.exists(archive_path):
+                            os.remove(archive_path)
+                            purged += 1
+                    summary['archives'] = []
+
+        # 索引提交後，本次 run 的摘要不會再被重複計入
+        self._save_archive_index(index)
+
+        # 以追加方式寫回保留記錄，並確保日誌文件存在；續做時依進度標記不重複寫入
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            if kept_lines and not pending['kept_written']:
+                f.write('\n'.join(kept_lines) + '\n')
+        pending['kept_written'] = True
+        self._save_archive_index(index)
+
+        os.remove(compacting_file)
+        index.pop('pending', None)
+        self._save_archive_index(index)
+
+        print(f"✅ 已歸檔 {archived} 條記錄到 {archived_segments} 個分段: {self.archive_dir}")
+        if retention_days is not None:
+            print(f"🗑️  已按保留策略刪除 {purged} 個壓縮檔（摘要保留）")
+        return True
+
     def analyze_patterns(self, hours=24):
         """分析命令執行模式"""
-        if not self.entries:
-            print("📊 沒有命令執行記錄")
-            return
-        
         cutoff_time = datetime.now() - timedelta(hours=hours)
         recent_entries = []
         
@@ -85,15 +293,20 @@ class CommandAuditViewer:
             if entry and entry['timestamp'] >= cutoff_time:
                 recent_entries.append(entry)
         
-        if not recent_entries:
+        # 已歸檔的時段只讀取摘要（按小時粒度）
+        command_types, archived_hourly, _, _ = self._archived_counts(since=cutoff_time)
+        
+        if not recent_entries and not command_types:
             print(f"📊 過去 {hours} 小時內沒有命令執行記錄")
             return
         
         # 統計分析
-        total_commands = len(recent_entries)
-        command_types = Counter(entry['type'] for entry in recent_entries)
+        command_types.update(entry['type'] for entry in recent_entries)
+        total_commands = sum(command_types.values())
         hourly_distribution = defaultdict(int)
         
+        for hour_key, count in archived_hourly.items():
+            hourly_distribution[int(hour_key[11:13])] += count
         for entry in recent_entries:
             hour = entry['timestamp'].hour
             hourly_distribution[hour] += 1
@@ -122,21 +335,22 @@ class CommandAuditViewer:
             print(f"  {time_str} | {entry['type']} | {entry['command'][:60]}...")
     
     def show_summary(self):
-        """顯示總體摘要"""
-        if not self.entries:
-            print("📊 沒有命令執行記錄")
-            return
-        
+        """顯示總體摘要（已歸檔時段僅讀取摘要）"""
         parsed_entries = [self.parse_entry(entry) for entry in self.entries]
         parsed_entries = [e for e in parsed_entries if e]
         
-        if not parsed_entries:
+        command_types, _, first_command, last_command = self._archived_counts()
+        
+        if not parsed_entries and not command_types:
             print("📊 沒有有效的命令執行記錄")
             return
         
-        total_commands = len(parsed_entries)
-        first_command = min(entry['timestamp'] for entry in parsed_entries)
-        last_command = max(entry['timestamp'] for entry in parsed_entries)
+        command_types.update(entry['type'] for entry in parsed_entries)
+        total_commands = sum(command_types.values())
+        timestamps = [entry['timestamp'] for entry in parsed_entries]
+        timestamps += [t for t in (first_command, last_command) if t]
+        first_command = min(timestamps)
+        last_command = max(timestamps)
         duration = (last_command - first_command).total_seconds() / 3600  # hours
         
         print("📊 命令審計總結")
@@ -149,7 +363,6 @@ class CommandAuditViewer:
             print(f"平均頻率: {total_commands / duration:.1f} 個/小時")
         
         # 類型統計
-        command_types = Counter(entry['type'] for entry in parsed_entries)
         print("\n📈 命令類型:")
         for cmd_type, count in command_types.most_common():
             percentage = (count / total_commands) * 100
@@ -200,24 +413,48 @@ def main():
     parser = argparse.ArgumentParser(description="命令審計日誌分析工具")
     parser.add_argument('--log-file', default='.command_audit.log', 
                        help='審計日誌文件路徑')
+    parser.add_argument('--archive-dir',
+                       help='歸檔目錄（默認為日誌旁的 .command_audit_archive）')
     parser.add_argument('--hours', type=int, default=24,
                        help='分析最近N小時的數據')
     parser.add_argument('--summary', action='store_true',
                        help='顯示總體摘要')
     parser.add_argument('--top-commands', type=int, metavar='N',
-                       help='顯示最常用的N個命令')
+                       help='顯示最常用的N個命令（僅未歸檔日誌）')
     parser.add_argument('--export', metavar='FILE',
-                       help='導出詳細報告到JSON文件')
+                       help='導出詳細報告到JSON文件（僅未歸檔日誌）')
     parser.add_argument('--test', action='store_true',
                        help='測試模式（不讀取真實日誌）')
     
+    subparsers = parser.add_subparsers(dest='command')
+    compact_parser = subparsers.add_parser('compact', help='壓縮歸檔舊日誌並套用保留策略')
+    compact_parser.add_argument('--keep-hours', type=int, default=24,
+                               help='保留在原日誌中的最近N小時記錄')
+    compact_parser.add_argument('--max-size', type=float, metavar='MB',
+                               help='僅當日誌超過此大小(MB)時壓縮')
+    compact_parser.add_argument('--max-age', type=int, metavar='HOURS',
+                               help='僅當最早記錄超過N小時時壓縮')
+    compact_parser.add_argument('--retention-days', type=int,
+                               help='刪除超過N天的壓縮檔（摘要保留）')
+    
     args = parser.parse_args()
     
     if args.test:
         print("✅ 命令審計工具測試模式 - 功能正常")
         return 0
     
-    viewer = CommandAuditViewer(args.log_file)
+    viewer = CommandAuditViewer(args.log_file, args.archive_dir)
+    
+    # 壓縮直接流式讀取日誌，不需預先載入全部記錄
+    if args.command == 'compact':
+        try:
+            if not viewer.compact(args.keep_hours, args.max_size, args.max_age,
+                                  args.retention_days):
+                return 1
+        except Exception as e:
+            print(f"❌ 壓縮失敗: {e}")
+            return 1
+        return 0
     
     if not viewer.load_logs():
         return 1
@@ -296,6 +296,7 @@ Thumbs.db
 
 # Project specific
 .command_audit.log
+.command_audit_archive/
 .quality_check_report.json
 EOF
 